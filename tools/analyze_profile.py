@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Profile Log Analyzer for kOS Profile Builds
+
+Reads the timing log recorded by a profile build (see 'profiling.py') and
+reports, for every instrumented library function and main loop:
+- call (iteration) counts,
+- inclusive and exclusive instruction cost,
+- the worst single-tick spike and the longest span in physics ticks.
+
+Instruction costs come from 'opcodesleft' samples. Within one physics tick the
+cost is the drop in 'opcodesleft'; across ticks, every whole tick in between
+is counted as a full IPU, so spans that WAIT are reported as busy.
+
+The profiler's own cost is removed where it is measured: buffer flushes ('F'
+lines) are excluded from every function and loop they interrupted, and the
+cost of an empty profiled call (the calibration id 0, sampled when the library
+loads) is subtracted once per profiled function call. The overhead per call is
+reported alongside the results.
+
+Every build reassigns sample ids, so only runs whose header carries the build
+id of the current profile map are analyzed; runs recorded with earlier builds
+(or without a header) are skipped and counted.
+
+The report is printed and saved to 'profile/<package>.json' in the archive,
+where 'build.py' picks it up for the package's size and cost report.
+
+Usage:
+    python analyze_profile.py <package> [--log PATH] [--map PATH] [--tick SECONDS]
+
+If the vessel was not connected while profiling, copy its log to the archive
+first, e.g. copyPath("1:/profile.log", "0:/profile/<package>.log").
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from profiling import CALIBRATION_ID, PROFILE_MAP_NAME, PROFILE_SUFFIX
+
+# --- Configuration Constants (Derived from Script Location) ---
+ARCHIVE = Path(__file__).resolve().parents[1]
+BUILD = ARCHIVE / "build"
+# Directory holding profile logs and analyzed reports
+PROFILE = ARCHIVE / "profile"
+
+# Default physics tick length in seconds (KSP's fixed delta time, no warp)
+DEFAULT_TICK = 0.02
+
+
+class Sample:
+    """
+    A single entry ('E'), exit ('X') or flush ('F') sample from the profile log.
+    Flush samples hold 'opcodesleft' before the flush in 'opcodes_left' and
+    after it in 'opcodes_after'.
+    """
+
+    __slots__ = ("kind", "sample_id", "time", "opcodes_left", "opcodes_after")
+
+    def __init__(
+        self,
+        kind: str,
+        sample_id: int,
+        time: float,
+        opcodes_left: int,
+        opcodes_after: Optional[int] = None,
+    ):
+        self.kind = kind
+        self.sample_id = sample_id
+        self.time = time
+        self.opcodes_left = opcodes_left
+        self.opcodes_after = opcodes_after
+
+
+class Frame:
+    """An open function call or loop iteration while replaying a run."""
+
+    __slots__ = ("sample_id", "kind", "entry", "children", "descendant_calls", "excluded")
+
+    def __init__(self, sample_id: int, kind: str, entry: Sample):
+        self.sample_id = sample_id
+        self.kind = kind
+        self.entry = entry
+        # Net inclusive cost of direct children
+        self.children = 0
+        # Number of profiled function calls made within this frame
+        self.descendant_calls = 0
+        # Profiler flush cost that happened within this frame
+        self.excluded = 0
+
+
+class Stats:
+    """Accumulated costs for one function or loop."""
+
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.calls = 0
+        self.inclusive = 0
+        self.exclusive = 0
+        self.worst_tick = 0
+        self.max_ticks = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "calls": self.calls,
+            "inclusive": self.inclusive,
+            "exclusive": self.exclusive,
+            "inclusive_per_call": round(self.inclusive / self.calls, 1) if self.calls else 0,
+            "exclusive_per_call": round(self.exclusive / self.calls, 1) if self.calls else 0,
+            "worst_tick": self.worst_tick,
+            "max_ticks": self.max_ticks,
+        }
+
+
+def parse_log(text: str, build_id: str) -> Tuple[List[Tuple[int, List[Sample]]], int]:
+    """
+    Splits a profile log into runs, one per header line, keeping only the runs
+    recorded with the given build id.
+
+    Returns:
+        A tuple of (list of (ipu, samples) pairs, number of runs skipped).
+        Malformed lines are skipped.
+    """
+    runs: List[Tuple[int, List[Sample]]] = []
+    skipped = 0
+    # Samples of the current run, or None while skipping a run
+    samples: Optional[List[Sample]] = None
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        try:
+            if fields[0] == "H":
+                if len(fields) == 4 and fields[3] == build_id:
+                    samples = []
+                    runs.append((int(float(fields[1])), samples))
+                else:
+                    samples = None
+                    skipped += 1
+                continue
+            if samples is None:
+                # Samples before the first header (e.g. from a log written
+                # before headers carried a build id) count as one skipped run
+                if not runs and not skipped:
+                    skipped += 1
+                continue
+            if fields[0] == "F" and len(fields) == 4:
+                samples.append(
+                    Sample("F", -1, float(fields[1]), int(float(fields[2])), int(float(fields[3])))
+                )
+            elif fields[0][0] in "EX" and len(fields) == 3:
+                samples.append(
+                    Sample(fields[0][0], int(fields[0][1:]), float(fields[1]), int(float(fields[2])))
+                )
+        except (ValueError, IndexError):
+            continue
+    return runs, skipped
+
+
+def span_cost(start: Sample, end: Sample, ipu: int, tick: float) -> Tuple[int, int, int]:
+    """
+    Computes the cost between two samples.
+
+    Returns:
+        A tuple of (instructions, worst single-tick instructions, ticks spanned).
+    """
+    ticks = max(0, round((end.time - start.time) / tick))
+    if ticks == 0:
+        cost = max(0, start.opcodes_left - end.opcodes_left)
+        return cost, cost, 0
+    first = start.opcodes_left
+    last = max(0, ipu - end.opcodes_left)
+    cost = first + (ticks - 1) * ipu + last
+    worst = max(first, last, ipu if ticks > 1 else 0)
+    return cost, worst, ticks
+
+
+def flush_cost(sample: Sample, ipu: int) -> int:
+    """Computes the cost of a flush, assuming it crossed at most one tick."""
+    if sample.opcodes_after <= sample.opcodes_left:
+        return sample.opcodes_left - sample.opcodes_after
+    return sample.opcodes_left + ipu - sample.opcodes_after
+
+
+def median(values: List[int]) -> int:
+    """Returns the median of a non-empty list of integers (lower middle)."""
+    ordered = sorted(values)
+    return ordered[(len(ordered) - 1) // 2]
+
+
+def measure_overhead(samples: List[Sample], ipu: int, tick: float) -> Optional[int]:
+    """
+    Measures the profiler's overhead per function call from the calibration
+    calls (id 0) of a run, using only calls that stayed within one tick.
+    """
+    costs: List[int] = []
+    entry: Optional[Sample] = None
+    for sample in samples:
+        if sample.sample_id != CALIBRATION_ID:
+            continue
+        if sample.kind == "E":
+            entry = sample
+        elif sample.kind == "X" and entry is not None:
+            cost, _, ticks = span_cost(entry, sample, ipu, tick)
+            if ticks == 0:
+                costs.append(cost)
+            entry = None
+    return median(costs) if costs else None
+
+
+def analyze(
+    runs: List[Tuple[int, List[Sample]]],
+    names: Dict[int, Dict[str, str]],
+    tick: float,
+) -> Tuple[Dict[int, Stats], int]:
+    """
+    Matches entry and exit samples with a call stack and accumulates costs,
+    net of measured profiler overhead.
+
+    A new entry for a loop that is still open (an iteration left through BREAK)
+    and any frames still open at the end of a run are discarded. Functions may
+    re-enter their own id (recursion), so their frames are never discarded.
+
+    Returns:
+        A tuple of (stats per sample id, overhead per call used).
+    """
+    stats: Dict[int, Stats] = {}
+    overheads = [
+        overhead
+        for ipu, samples in runs
+        if (overhead := measure_overhead(samples, ipu, tick)) is not None
+    ]
+    # Runs without a usable calibration fall back to the overall median
+    default_overhead = median(overheads) if overheads else 0
+
+    for ipu, samples in runs:
+        overhead = measure_overhead(samples, ipu, tick)
+        if overhead is None:
+            overhead = default_overhead
+
+        stack: List[Frame] = []
+        for sample in samples:
+            if sample.sample_id == CALIBRATION_ID:
+                continue
+
+            if sample.kind == "F":
+                cost = flush_cost(sample, ipu)
+                for frame in stack:
+                    frame.excluded += cost
+                continue
+
+            if sample.kind == "E":
+                kind = names.get(sample.sample_id, {}).get("kind", "unknown")
+                if kind == "loop":
+                    open_loops = [f.sample_id for f in stack]
+                    if sample.sample_id in open_loops:
+                        del stack[open_loops.index(sample.sample_id):]
+                stack.append(Frame(sample.sample_id, kind, sample))
+                continue
+
+            # Match the innermost open frame with this id
+            open_ids = [f.sample_id for f in stack]
+            if sample.sample_id not in open_ids:
+                continue
+            match_index = len(open_ids) - 1 - open_ids[::-1].index(sample.sample_id)
+            # Drop frames that never exited (e.g. loops left through BREAK)
+            del stack[match_index + 1:]
+            frame = stack.pop()
+
+            raw, worst, ticks = span_cost(frame.entry, sample, ipu, tick)
+            own_overhead = overhead if frame.kind == "function" else 0
+            inclusive = max(
+                0, raw - frame.excluded - overhead * frame.descendant_calls - own_overhead
+            )
+            exclusive = max(0, inclusive - frame.children)
+            if ticks == 0:
+                worst = inclusive
+
+            entry_names = names.get(frame.sample_id, {"name": f"#{frame.sample_id}", "kind": "unknown"})
+            record = stats.setdefault(
+                frame.sample_id, Stats(entry_names["name"], entry_names["kind"])
+            )
+            record.calls += 1
+            record.inclusive += inclusive
+            record.exclusive += exclusive
+            record.worst_tick = max(record.worst_tick, worst)
+            record.max_ticks = max(record.max_ticks, ticks)
+            if stack:
+                stack[-1].children += inclusive
+                stack[-1].descendant_calls += frame.descendant_calls + (
+                    1 if frame.kind == "function" else 0
+                )
+    return stats, default_overhead
+
+
+def print_report(package: str, stats: Dict[int, Stats], overhead: int) -> None:
+    """Prints the per-function and per-loop cost table, costliest first."""
+    print(f"=== Profile of {package} ===")
+    print(f"profiler overhead per call: {overhead} instructions (subtracted)")
+    print(
+        f"{'name':<36}{'kind':>10}{'calls':>8}{'incl/call':>11}"
+        f"{'excl/call':>11}{'excl total':>12}{'worst tick':>12}{'ticks':>7}"
+    )
+    for record in sorted(stats.values(), key=lambda r: r.exclusive, reverse=True):
+        row = record.as_dict()
+        print(
+            f"{record.name:<36}{record.kind:>10}{record.calls:>8}"
+            f"{row['inclusive_per_call']:>11}{row['exclusive_per_call']:>11}"
+            f"{record.exclusive:>12}{record.worst_tick:>12}{record.max_ticks:>7}"
+        )
+
+
+def main() -> None:
+    """
+    Main execution function. Loads the profile map and log for a package,
+    prints the cost report and saves it for the next build.
+    """
+    parser = argparse.ArgumentParser(description="Analyze a kOS profile build log.")
+    parser.add_argument("package", help="package name as listed in manifest.yaml")
+    parser.add_argument("--log", type=Path, help="profile log (default: profile/<package>.log)")
+    parser.add_argument("--map", type=Path, help="profile map (default: from the profile build)")
+    parser.add_argument("--tick", type=float, default=DEFAULT_TICK, help="physics tick in seconds")
+    args = parser.parse_args()
+
+    log_path = args.log or PROFILE / f"{args.package}.log"
+    map_path = args.map or BUILD / f"{args.package}{PROFILE_SUFFIX}" / PROFILE_MAP_NAME
+
+    profile_map = json.loads(map_path.read_text(encoding="utf-8"))
+    names = {int(k): v for k, v in profile_map["ids"].items()}
+    runs, skipped = parse_log(log_path.read_text(encoding="utf-8"), profile_map["build_id"])
+    if skipped:
+        print(f"Skipped {skipped} run(s) recorded with other builds of {args.package}.")
+    if not runs:
+        print(f"No runs of build {profile_map['build_id']} in: {log_path}")
+        return
+
+    stats, overhead = analyze(runs, names, args.tick)
+    print_report(args.package, stats, overhead)
+
+    # Function costs are keyed by uppercase name to match the build's function index
+    report = {
+        "package": args.package,
+        "build_id": profile_map["build_id"],
+        "runs": len(runs),
+        "overhead_per_call": overhead,
+        "costs": {
+            (r.name.upper() if r.kind == "function" else r.name): r.as_dict()
+            for r in stats.values()
+        },
+    }
+    report_path = PROFILE / f"{args.package}.json"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    print(f"\nWrote profile report to: {report_path.relative_to(ARCHIVE)}")
+
+
+if __name__ == "__main__":
+    main()
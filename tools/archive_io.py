@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Archive I/O Layer with Concurrent Prefetching
+
+The kOS archive is often shared between installs over a network mount, where
+every 'read_text' and 'exists' call is a synchronous round-trip. This module
+discovers the archive's source files up front, fetches their contents
+concurrently with a bounded thread pool, and serves every later read and
+existence check from memory.
+
+Fetching overlaps with the build: 'read_text' only blocks until the requested
+file has arrived, not until the whole archive has been fetched.
+
+Usage:
+    start_prefetch([SRC])
+    try:
+        text = read_text(SRC / "core" / "orbit.ks")
+    finally:
+        stop_prefetch()
+
+When no prefetch is active, 'read_text' and 'exists' fall through to the
+filesystem, so callers behave the same with or without prefetching.
+
+Values derived from archive content (e.g. parsed function indexes) can be kept
+in a 'session_cache'. Session caches only hold values while a prefetch is
+active and are cleared whenever one starts or stops, so they never outlive the
+sources they were derived from.
+"""
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+
+# Default number of concurrent reads issued against the archive
+DEFAULT_MAX_WORKERS = 8
+# Only source files are prefetched (build outputs are written, not read)
+PREFETCH_SUFFIXES = (".ks",)
+
+
+def _normalize(path: Path) -> str:
+    """
+    Normalizes a path into a cache key without touching the filesystem
+    (case-folded on case-insensitive platforms such as Windows).
+    """
+    return os.path.normcase(os.path.abspath(os.fspath(path)))
+
+
+def _is_case_insensitive(root: Path) -> bool:
+    """
+    Probes whether the filesystem holding 'root' resolves paths regardless of
+    their casing, by checking for 'root' under a differently cased name.
+    """
+    parts = list(Path(os.path.abspath(root)).parts)
+    cased = [i for i, part in enumerate(parts) if part.swapcase() != part]
+    if not cased:
+        # No cased characters to probe with; fall back to the platform default
+        return os.path.normcase("A") == "a"
+    probe = parts.copy()
+    probe[cased[-1]] = probe[cased[-1]].swapcase()
+    try:
+        return os.path.samefile(Path(*probe), Path(*parts))
+    except OSError:
+        return False
+
+
+class ArchivePrefetcher:
+    """
+    Discovers source files below one or more roots and reads them concurrently.
+
+    Attributes:
+        files: Maps normalized file paths to futures of their text content.
+        listed_dirs: Normalized directories whose complete listing is known, so a
+            missing entry in 'files' is a definite "does not exist".
+        folded_files: Maps case-folded keys to keys in 'files' for roots on
+            case-insensitive filesystems (e.g. macOS volumes or SMB shares), so
+            paths resolve despite casing exactly as a direct read would.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="archive-prefetch"
+        )
+        self.files: Dict[str, Future] = {}
+        self.listed_dirs: Set[str] = set()
+        self.folded_files: Dict[str, str] = {}
+        # Results of 'exists' checks that fell through to the filesystem
+        self.exists_fallback: Dict[str, bool] = {}
+
+    def prefetch(self, root: Path) -> int:
+        """
+        Walks 'root' and submits a read for every source file as soon as it is
+        discovered, so fetching starts while discovery is still in progress.
+
+        Returns:
+            The number of files submitted.
+        """
+        fold_case = _is_case_insensitive(Path(root))
+        submitted = 0
+        for dir_path, _, file_names in os.walk(root):
+            for file_name in file_names:
+                if not file_name.endswith(PREFETCH_SUFFIXES):
+                    continue
+                key = _normalize(Path(dir_path) / file_name)
+                if key not in self.files:
+                    self.files[key] = self.executor.submit(
+                        Path(key).read_text, encoding="utf-8"
+                    )
+                    if fold_case:
+                        self.folded_files.setdefault(key.casefold(), key)
+                    submitted += 1
+            # Recorded only after the listing is complete
+            self.listed_dirs.add(_normalize(dir_path))
+        return submitted
+
+    def _resolve(self, key: str) -> str:
+        """
+        Maps a key to the prefetched key of the same file, matching casing
+        case-insensitively when there is no exact match and the file's root is
+        on a case-insensitive filesystem.
+        """
+        if key in self.files:
+            return key
+        return self.folded_files.get(key.casefold(), key)
+
+    def exists(self, path: Path) -> bool:
+        """Checks whether a file exists, answering from memory when possible."""
+        key = self._resolve(_normalize(path))
+        if key in self.files or key in self.listed_dirs:
+            return True
+        if os.path.dirname(key) in self.listed_dirs and key.endswith(PREFETCH_SUFFIXES):
+            return False
+        if key not in self.exists_fallback:
+            self.exists_fallback[key] = os.path.exists(key)
+        return self.exists_fallback[key]
+
+    def read_text(self, path: Path) -> str:
+        """
+        Returns the text of a file, waiting for its prefetch if it is in flight.
+        Files outside the prefetched set are read (and cached) on demand.
+        Read errors are raised to the caller exactly as a direct read would.
+        """
+        key = self._resolve(_normalize(path))
+        future = self.files.get(key)
+        if future is None:
+            future = self.executor.submit(Path(key).read_text, encoding="utf-8")
+            self.files[key] = future
+        return future.result()
+
+    def close(self) -> None:
+        """Stops the thread pool, cancelling any reads that have not started."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+# The active prefetcher, if any (see start_prefetch / stop_prefetch)
+_prefetcher: Optional[ArchivePrefetcher] = None
+# Named caches of values derived from archive content (see session_cache)
+_session_caches: Dict[str, dict] = {}
+
+
+def session_cache(name: str) -> dict:
+    """
+    Returns the named cache for the current session. All session caches are
+    cleared when a prefetch starts or stops. Without an active prefetch, sources
+    are read from disk on every call, so an empty throwaway cache is returned.
+    """
+    if _prefetcher is None:
+        return {}
+    return _session_caches.setdefault(name, {})
+
+
+def start_prefetch(roots: Iterable[Path], max_workers: int = DEFAULT_MAX_WORKERS) -> int:
+    """
+    Starts prefetching every source file below the given roots and routes later
+    'read_text' and 'exists' calls through the in-memory cache.
+
+    Returns:
+        The number of files discovered.
+    """
+    global _prefetcher
+    stop_prefetch()
+    _prefetcher = ArchivePrefetcher(max_workers)
+    return sum(_prefetcher.prefetch(Path(root)) for root in roots)
+
+
+def stop_prefetch() -> None:
+    """Stops the active prefetcher (if any) and drops its and all session caches."""
+    global _prefetcher
+    _session_caches.clear()
+    if _prefetcher is not None:
+        _prefetcher.close()
+        _prefetcher = None
+
+
+def read_text(path: Path) -> str:
+    """Reads a UTF-8 archive file, from the prefetch cache when active."""
+    if _prefetcher is None:
+        return Path(path).read_text(encoding="utf-8")
+    return _prefetcher.read_text(path)
+
+
+def exists(path: Path) -> bool:
+    """Checks whether an archive path exists, from the prefetch cache when active."""
+    if _prefetcher is None:
+        return Path(path).exists()
+    return _prefetcher.exists(path)
@@ -11,27 +11,61 @@ The build process for each package involves:
 1. Clearing and creating the necessary 'build' subdirectories.
 2. Copying the main boot script.
 3. Recursively processing 'offline_scripts' to identify and extract library
-   functions (cross-dependencies) into a dedicated library file.
+   functions (cross-dependencies) into a dedicated library file, dropping
+   library imports that contribute no used function.
 4. Generating simple 'online_scripts' wrappers.
 5. Saving persistent state information (if configured).
 6. Generating the final initial boot file that calls the installer.
 
+Packages with 'profile: true' in the manifest (or every package, when run with
+'--profile') are additionally built as an instrumented '<name>_profile' copy
+that logs per-function and per-loop timings in flight (see 'profiling.py' and
+'analyze_profile.py'). Scripts listed under a package's 'profile_scripts'
+(typically online control scripts such as launch.ks) are built as instrumented
+offline scripts in the profile copy only, replacing their online wrappers.
+Each build ends with a size and cost report that includes the measured costs
+once a profile has been analyzed.
+
+Once every package is built, a flat 'build/versions' index (one
+"<package> <version> <digest>" line per package) is written so that boot
+scripts can check for updates with a single file read.
+
+Archive sources are prefetched concurrently and read from memory through the
+'archive_io' module, so builds over network-mounted archives are not bound by
+per-file round-trip latency.
+
 It relies on external functions for dependency resolution:
 - refactor_script_for_cross_dependencies
 - collect_library_functions
+- find_unused_library_imports
 """
+import argparse
+import hashlib
+import json
 import os
 import shutil
 import yaml
 import re
 from pathlib import Path
 
+import archive_io
+
 # Assuming these functions are available in a 'dependencies' module
 from dependencies import (
     refactor_script_for_cross_dependencies,
     collect_library_functions,
     extract_kos_global_parameters,
     get_all_dependencies_recursive,
+    find_unused_library_imports,
+    remove_library_imports,
+)
+from profiling import (
+    PROFILE_MAP_NAME,
+    PROFILE_SUFFIX,
+    ProfileMap,
+    instrument_library_function,
+    instrument_script_loops,
+    profiler_runtime,
 )
 
 # --- Configuration Constants (Derived from Script Location) ---
@@ -40,11 +74,17 @@ ARCHIVE = Path(__file__).resolve().parents[1]
 SRC = ARCHIVE / "src"
 BUILD = ARCHIVE / "build"
 BOOT = ARCHIVE / "boot"
+# Profile logs (written in flight) and analyzed profile reports
+PROFILE = ARCHIVE / "profile"
 
 # Path to the main installer script used by the generated boot files
 INSTALLER = SRC / "pacman" / "install.ks"
 # Path to the package manifest file
 MANIFEST = ARCHIVE / "manifest.yaml"
+# Path to the archive-wide version index read by boot scripts
+VERSIONS = BUILD / "versions"
+# Number of concurrent reads used to prefetch archive sources
+PREFETCH_WORKERS = 8
 
 
 def load_manifest() -> dict:
@@ -70,12 +110,106 @@ def copy_script(src: Path, dst: Path) -> None:
         dst (Path): The destination path of the script.
     """
     os.makedirs(os.path.dirname(dst), exist_ok=True)
-    # Read/write using Path methods for simplicity
-    text = src.read_text(encoding="utf-8")
+    # Sources are read through the (possibly prefetched) archive I/O layer
+    text = archive_io.read_text(src)
     dst.write_text(text, encoding="utf-8")
 
 
-def build_package(name: str, cfg: dict) -> None:
+def compute_package_digest(package_root: Path) -> str:
+    """
+    Computes a short content digest over every file in a built package.
+
+    Files are hashed in sorted order together with their package-relative
+    paths, so the digest only changes when the package output changes.
+
+    Args:
+        package_root (Path): The build directory of the package.
+
+    Returns:
+        str: The first 12 hex characters of the SHA-1 digest.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(p for p in package_root.rglob("*") if p.is_file()):
+        digest.update(path.relative_to(package_root).as_posix().encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(path.read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()[:12]
+
+
+def write_versions_index(entries: dict) -> None:
+    """
+    Writes the archive-wide version index used by boot-time update checks.
+
+    The index is plain text with one "<package> <version> <digest>" line per
+    package, which kOS can read with a single 'open():readall' and test with
+    a string 'contains' instead of parsing JSON.
+
+    Args:
+        entries (dict): Maps package names to (version, digest) tuples.
+    """
+    lines = [f"{name} {version} {digest}" for name, (version, digest) in sorted(entries.items())]
+    # Every line (including the last) is newline-terminated so that boot
+    # scripts can match a whole line.
+    VERSIONS.parent.mkdir(parents=True, exist_ok=True)
+    VERSIONS.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+    print(f"Wrote version index to: {VERSIONS.relative_to(ARCHIVE)}")
+
+
+def load_profile_costs(name: str) -> dict:
+    """
+    Loads the measured costs for a package from its analyzed profile report
+    (written by 'analyze_profile.py'), if there is one.
+
+    Args:
+        name (str): The name of the (non-profile) package.
+
+    Returns:
+        dict: Maps uppercase function names and loop names to cost records.
+    """
+    report_path = PROFILE / f"{name}.json"
+    if not report_path.exists():
+        return {}
+    return json.loads(report_path.read_text(encoding="utf-8")).get("costs", {})
+
+
+def print_package_report(package_root: Path, library_functions: dict, costs: dict) -> None:
+    """
+    Prints the size of every library function and of the package as a whole,
+    alongside measured per-call costs where a profile report provides them.
+
+    Args:
+        package_root (Path): The build directory of the package.
+        library_functions (dict): The package's library FunctionDef records.
+        costs (dict): Measured costs as returned by 'load_profile_costs'.
+    """
+    print("--- Size and cost report ---")
+    print(f"{'name':<36}{'chars':>8}{'calls':>8}{'incl/call':>11}{'excl/call':>11}{'worst tick':>12}")
+
+    def cost_columns(cost: dict) -> str:
+        if not cost:
+            return f"{'-':>8}{'-':>11}{'-':>11}{'-':>12}"
+        return (
+            f"{cost['calls']:>8}{cost['inclusive_per_call']:>11}"
+            f"{cost['exclusive_per_call']:>11}{cost['worst_tick']:>12}"
+        )
+
+    for function_name, function_def in sorted(library_functions.items()):
+        size = function_def.end - function_def.start
+        print(f"{function_name:<36}{size:>8}{cost_columns(costs.get(function_name))}")
+    for loop_name, cost in sorted(costs.items()):
+        if cost.get("kind") == "loop":
+            print(f"{loop_name:<36}{'-':>8}{cost_columns(cost)}")
+
+    files = [p for p in package_root.rglob("*") if p.is_file()]
+    print(f"package size: {sum(p.stat().st_size for p in files)} bytes in {len(files)} files")
+    if not costs:
+        print("(no profile data; build with --profile and run analyze_profile.py)")
+    print()
+
+
+def build_package(name: str, cfg: dict, profile: bool = False) -> str:
     """
     Builds a single kOS package based on its manifest configuration.
 
@@ -85,7 +219,20 @@ def build_package(name: str, cfg: dict) -> None:
     Args:
         name (str): The name of the package (e.g., 'main_system').
         cfg (dict): The configuration dictionary for this package.
+        profile (bool): Build the instrumented '<name>_profile' copy instead.
+
+    Returns:
+        str: The content digest of the built package.
     """
+    # Profile builds are an instrumented copy under their own package name,
+    # but log to (and report on) the original package name.
+    base_name = name
+    profile_map = None
+    if profile:
+        name = f"{base_name}{PROFILE_SUFFIX}"
+        profile_map = ProfileMap(base_name, f"0:/profile/{base_name}.log")
+        PROFILE.mkdir(exist_ok=True)
+
     # --- 1. Define Package Paths ---
     package_root = BUILD / name
     boot_dir = package_root / "boot"
@@ -134,19 +281,36 @@ def build_package(name: str, cfg: dict) -> None:
 
     # Paths to scripts that need to be processed
     scripts_to_process = set(cfg.get("offline_scripts", []))
+    # Profile copies also run their 'profile_scripts' locally, so that their
+    # library calls and main loops are instrumented.
+    profile_scripts = set(cfg.get("profile_scripts", [])) if profile else set()
+    scripts_to_process.update(profile_scripts)
     # Paths already successfully processed
     processed_scripts = set()
-    # Dictionary to hold unique function strings extracted from all scripts
+    # Dictionary to hold unique function definitions extracted from all scripts
+    # (records pointing into each library's buffer, not copies of the code)
     full_library_functions = dict()
 
     # Loop continues until all scripts, including newly discovered dependencies,
     # have been processed.
     while scripts_to_process - processed_scripts:
         # Iterate only over scripts not yet processed
-        for script_path_kos in scripts_to_process - processed_scripts:
+        # Sorted so that the library (and therefore the digest) is reproducible.
+        for script_path_kos in sorted(scripts_to_process - processed_scripts):
             # [3:] strips "0:/" to get the relative archive path.
             source_script_path = ARCHIVE / script_path_kos[3:]
-            script_content = source_script_path.read_text(encoding="utf-8")
+            source_content = archive_io.read_text(source_script_path)
+            script_content = source_content
+
+            # Drop library imports that contribute no function the script reaches,
+            # so the script never loads (or compiles) a library it does not use.
+            unused_library_paths = find_unused_library_imports(script_content, ARCHIVE)
+            for unused_path in sorted(unused_library_paths):
+                print(
+                    f"Warning: {script_path_kos} imports {unused_path} but uses none "
+                    "of its functions; dropping import."
+                )
+            script_content = remove_library_imports(script_content, unused_library_paths)
 
             # Refactor the script to resolve internal calls (RUNPATH, RUNONCEPATH)
             # The refactoring extracts library dependencies and modifies script calls.
@@ -154,9 +318,22 @@ def build_package(name: str, cfg: dict) -> None:
                 refactor_script_for_cross_dependencies(script_content, lib_name)
             )
 
+            # Profile builds sample each main-loop iteration
+            if profile_map:
+                modified_script = instrument_script_loops(
+                    modified_script,
+                    source_script_path.name,
+                    lib_name,
+                    profile_map,
+                    source_content=source_content,
+                )
+
             # Add any newly discovered script dependencies (from RUNPATH/RUNONCEPATH calls)
-            # to the set to be processed in future iterations.
-            scripts_to_process.update(script_paths)
+            # to the set to be processed in future iterations. kOS lets RUNPATH omit
+            # the '.ks' extension, so add it to match the manifest's script paths.
+            scripts_to_process.update(
+                path if Path(path).suffix else f"{path}.ks" for path in script_paths
+            )
 
             # Scan libraries for dependencies of dependencies
             all_library_paths = set(library_paths)
@@ -186,14 +363,31 @@ def build_package(name: str, cfg: dict) -> None:
             print()
 
     # --- 5. Build Library File ---
-    # Create the library script content by combining all unique extracted functions.
-    library_content = f"// {lib_name} - Generated library script\n@lazyGlobal off.\n\n"
-
-    # Functions are reversed to ensure functions called by others are defined earlier.
-    for function_string in reversed(full_library_functions.values()):
-        library_content += function_string + "\n\n"
-
-    lib_dst.write_text(library_content, encoding="utf-8")
+    # Stream all unique extracted functions into the library script, slicing
+    # each function's code out of its source buffer only as it is written.
+    with open(lib_dst, "w", encoding="utf-8") as lib_file:
+        lib_file.write(f"// {lib_name} - Generated library script\n@lazyGlobal off.\n\n")
+        # Functions are reversed to ensure functions called by others are defined earlier.
+        if profile_map:
+            # Functions are instrumented before the runtime is written, so that
+            # its header carries the build id of the complete profile map.
+            instrumented_functions = [
+                instrument_library_function(function_def.text, profile_map)
+                for function_def in reversed(full_library_functions.values())
+            ]
+            lib_file.write(profiler_runtime(profile_map.log_path, profile_map.build_id()))
+            for function_text in instrumented_functions:
+                lib_file.write(function_text)
+                lib_file.write("\n\n")
+        else:
+            for function_def in reversed(full_library_functions.values()):
+                lib_file.write(function_def.text)
+                lib_file.write("\n\n")
+
+    if profile_map:
+        profile_map_file = package_root / PROFILE_MAP_NAME
+        profile_map.write(profile_map_file)
+        print(f"Wrote profile map to: {profile_map_file.relative_to(ARCHIVE)}")
 
     print(f"--- {lib_name}.ks ---")
     print("total functions:", set(full_library_functions.keys()))
@@ -202,8 +396,12 @@ def build_package(name: str, cfg: dict) -> None:
 
     # --- 6. Generate Online Scripts (Simple Wrappers) ---
     for script_path_kos in cfg.get("online_scripts", []):
+        # Replaced by an instrumented offline copy in profile builds
+        if script_path_kos in profile_scripts:
+            continue
+
         parameter_definitions = extract_kos_global_parameters(
-            (ARCHIVE / script_path_kos[3:]).read_text()
+            archive_io.read_text(ARCHIVE / script_path_kos[3:])
         )
 
         param_list = ""
@@ -235,6 +433,10 @@ def build_package(name: str, cfg: dict) -> None:
         print()
 
     # --- 7. Add Persistent State (if required) ---
+    # The digest covers the package content only, so it is computed before
+    # the state file (which records it) is written.
+    package_digest = compute_package_digest(package_root)
+
     if cfg.get("persistent_data"):
         package_state_content = """
 {
@@ -254,6 +456,14 @@ def build_package(name: str, cfg: dict) -> None:
         {
             "value": "VERSION",
             "$type": "kOS.Safe.Encapsulation.StringValue"
+        },
+        {
+            "value": "digest",
+            "$type": "kOS.Safe.Encapsulation.StringValue"
+        },
+        {
+            "value": "DIGEST",
+            "$type": "kOS.Safe.Encapsulation.StringValue"
         }
     ],
     "$type": "kOS.Safe.Encapsulation.Lexicon"
@@ -261,6 +471,7 @@ def build_package(name: str, cfg: dict) -> None:
 """
         package_state_content = package_state_content.replace("PACKAGE", name)
         package_state_content = package_state_content.replace("VERSION", cfg_version)
+        package_state_content = package_state_content.replace("DIGEST", package_digest)
         state_file = package_root / "state.json"
         state_file.write_text(package_state_content)
 
@@ -268,7 +479,9 @@ def build_package(name: str, cfg: dict) -> None:
 
     # --- 8. Create Initial Boot Script ---
     # This is the script the user runs to start the installation process.
-    boot_name = cfg.get("boot_name", f"boot_{name}.ks")
+    boot_name = cfg.get("boot_name", f"boot_{base_name}.ks")
+    if profile:
+        boot_name = f"{Path(boot_name).stem}{PROFILE_SUFFIX}.ks"
     boot_file = BOOT / boot_name
 
     # This boot script executes the main installer script with package parameters.
@@ -284,23 +497,49 @@ def build_package(name: str, cfg: dict) -> None:
     print(f"Wrote initial boot script to: {boot_file.relative_to(ARCHIVE)}")
     print()
 
-    print(f"=== Finished building {name} v{cfg_version} ===")
+    # --- 9. Report Package Size and Measured Costs ---
+    print_package_report(package_root, full_library_functions, load_profile_costs(base_name))
+
+    print(f"=== Finished building {name} v{cfg_version} ({package_digest}) ===")
     print(f"Build output path: {package_root.relative_to(ARCHIVE)}")
 
+    return package_digest
+
 
 def main() -> None:
     """
     Main execution function. Loads the manifest and iterates over packages
     to initiate the build process for each one.
     """
+    parser = argparse.ArgumentParser(description="Build kOS packages from manifest.yaml.")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="also build an instrumented '<name>_profile' copy of every package",
+    )
+    args = parser.parse_args()
+
     try:
+        # Fetch all archive sources concurrently up front; the build then reads
+        # them from memory as soon as each one has arrived.
+        prefetched = archive_io.start_prefetch([SRC], max_workers=PREFETCH_WORKERS)
+        print(f"Prefetching {prefetched} source files from: {SRC.relative_to(ARCHIVE)}")
+
         packages = load_manifest()
+        versions = dict()
         for name, cfg in packages.items():
-            build_package(name, cfg)
+            digest = build_package(name, cfg)
+            versions[name] = (cfg.get("version", "0.0.1"), digest)
+            if args.profile or cfg.get("profile"):
+                digest = build_package(name, cfg, profile=True)
+                versions[f"{name}{PROFILE_SUFFIX}"] = (cfg.get("version", "0.0.1"), digest)
+        write_versions_index(versions)
         print("\nBuild complete.")
     except Exception as e:
         print(f"\nERROR: An unexpected error occurred during the build: {e}")
         raise
+    finally:
+        archive_io.stop_prefetch()
 
 
 if __name__ == "__main__":
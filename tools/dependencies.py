@@ -11,11 +11,72 @@ Key responsibilities:
 2. Robustly extracting function definitions from kOS scripts while ignoring comments.
 3. Performing a Breadth-First Search (BFS) to identify all necessary library
    functions (including those called indirectly) for a given script.
+4. Pruning library imports (RUNONCEPATH calls) that contribute no function the
+   script actually reaches.
+
+Function definitions are indexed as compact FunctionDef records holding
+(start, end) offsets into one comment-stripped buffer per file; function text
+is only sliced out when the library file is written.
 """
 import re
-from typing import Dict, Set, Tuple, List
+import sys
+from typing import Dict, Set, Tuple, List, Optional
 from pathlib import Path
 
+import archive_io
+
+# Matches a library import call (RUNONCEPATH).
+# Pattern explanation:
+# (1:command): Captures 'runoncepath' (case-insensitive)
+# (2:open_quote): Captures ' or "
+# (3:path): Captures the original path (e.g., "0:/lib/utils.ks")
+# \2: Matches the closing quote captured by group 2
+# (4:remaining_args): Captures any arguments following the path, including the comma.
+LIBRARY_IMPORT_PATTERN = re.compile(
+    r"(runoncepath)\s*\(([\"'])(.*?)\2([^)]*)\)", re.IGNORECASE
+)
+
+# Matches a complete library import statement, including its terminating '.'
+# and any whitespace following it on the same line.
+LIBRARY_IMPORT_STATEMENT_PATTERN = re.compile(
+    r"\brunoncepath\s*\(\s*([\"'])(.*?)\1[^)]*\)\s*\.[ \t]*",
+    re.IGNORECASE,
+)
+
+
+class FunctionDef:
+    """
+    A function definition located by offsets into a shared per-file buffer.
+
+    Attributes:
+        name: The interned, uppercase function name.
+        buffer: The comment-stripped content of the file defining the function.
+        start: Offset of the first character of the definition in 'buffer'.
+        end: Offset one past the last character of the definition in 'buffer'.
+    """
+
+    __slots__ = ("name", "buffer", "start", "end")
+
+    def __init__(self, name: str, buffer: str, start: int, end: int):
+        self.name = sys.intern(name.upper())
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    @property
+    def text(self) -> str:
+        """The complete function code (sliced from the buffer on each access)."""
+        return self.buffer[self.start:self.end]
+
+    def __repr__(self) -> str:
+        return f"FunctionDef({self.name!r}, {self.start}:{self.end})"
+
+
+# Name of the archive_io session cache holding function indexes of library
+# files, keyed by host path. Each library is read and scanned once per prefetch
+# session (i.e. per build), no matter how many scripts import it.
+LIBRARY_INDEX_CACHE = "library_index"
+
 
 def refactor_script_for_cross_dependencies(
     script_content: str, lib_name: str
@@ -41,15 +102,7 @@ def refactor_script_for_cross_dependencies(
 
     # --- 1. Handle runoncepath calls (Libraries) ---
     # Libraries are consolidated into a single file and the call is redirected.
-    # Pattern explanation:
-    # (1:command): Captures 'runoncepath' (case-insensitive)
-    # (2:open_quote): Captures ' or "
-    # (3:path): Captures the original path (e.g., "0:/lib/utils.ks")
-    # \2: Matches the closing quote captured by group 2
-    # (4:remaining_args): Captures any arguments following the path, including the comma.
-    lib_pattern = re.compile(
-        r"(runoncepath)\s*\(([\"'])(.*?)\2([^)]*)\)", re.IGNORECASE
-    )
+    lib_pattern = LIBRARY_IMPORT_PATTERN
 
     # Find and collect all original library source paths
     for match in lib_pattern.finditer(modified_script):
@@ -68,6 +121,10 @@ def refactor_script_for_cross_dependencies(
 
     modified_script = lib_pattern.sub(lib_replacer, modified_script)
 
+    # Several imports now load the same library file; keep only the first
+    # load on each code path.
+    modified_script = collapse_library_loads(modified_script, f"1:/lib/{lib_name}")
+
     # --- 2. Handle runPath calls (Scripts) ---
     # Scripts are copied to the package root, and the call is redirected to the
     # script's stem name in the package-relative path.
@@ -104,6 +161,63 @@ def refactor_script_for_cross_dependencies(
     return modified_script, library_paths, script_paths
 
 
+def collapse_library_loads(script_content: str, lib_path: str) -> str:
+    """
+    Removes RUNONCEPATH statements for 'lib_path' that are already preceded by
+    a load of the same library on the same code path: earlier in the same
+    block, or in an enclosing block that is still open. Function bodies may be
+    called from anywhere, so loads outside a function never cover loads inside it.
+
+    Args:
+        script_content: The refactored kOS script content.
+        lib_path: The package-relative library path (e.g., "1:/lib/system_lib").
+
+    Returns:
+        The script content with redundant library loads removed.
+    """
+    load_pattern = re.compile(
+        r"\brunoncepath\s*\(\s*([\"'])" + re.escape(lib_path) + r"\1\s*\)\s*\.[ \t]*",
+        re.IGNORECASE,
+    )
+    function_pattern = re.compile(r"^\s*function\s+\w+\s*\{", re.IGNORECASE)
+
+    # One frame per open block: [is_function_body, library_loaded]
+    stack: List[List[bool]] = [[True, False]]
+    output_lines: List[str] = []
+    for line in script_content.splitlines(keepends=True):
+        body = line.rstrip("\r\n")
+        newline = line[len(body):]
+        comment_index = body.find("//")
+        code = body if comment_index == -1 else body[:comment_index]
+        comment = "" if comment_index == -1 else body[comment_index:]
+
+        def load_remover(match: re.Match) -> str:
+            for is_function_body, loaded in reversed(stack):
+                if loaded:
+                    return ""
+                if is_function_body:
+                    break
+            stack[-1][1] = True
+            return match.group(0)
+
+        new_code = load_pattern.sub(load_remover, code)
+        if new_code == code:
+            output_lines.append(line)
+        elif new_code.strip():
+            output_lines.append(new_code.rstrip() + (" " + comment if comment else "") + newline)
+
+        # Track blocks opened and closed on this line
+        opens_function = bool(function_pattern.match(code))
+        for ch in code:
+            if ch == "{":
+                stack.append([opens_function, False])
+                opens_function = False
+            elif ch == "}" and len(stack) > 1:
+                stack.pop()
+
+    return "".join(output_lines)
+
+
 def get_script_dependencies(script_path: str, archive_dir_path: Path) -> Set[str]:
     """
     Recursively scans a kOS script and returns all dependency paths referenced by
@@ -119,20 +233,15 @@ def get_script_dependencies(script_path: str, archive_dir_path: Path) -> Set[str
         Each path is returned exactly as written in the script.
     """
     # --- Normalize and resolve file path ---
-    if script_path.startswith("0:/"):
-        relative_path = Path(script_path[3:]).with_suffix(".ks")
-    else:
-        relative_path = Path(script_path).with_suffix(".ks")
-
-    absolute_path = archive_dir_path / relative_path
+    absolute_path = resolve_kos_path(script_path, archive_dir_path)
 
-    if not absolute_path.exists():
+    if not archive_io.exists(absolute_path):
         print(f"Warning: Script not found: {absolute_path}")
         return set()
 
     # --- Read the script content ---
     try:
-        script_content = absolute_path.read_text(encoding="utf-8")
+        script_content = archive_io.read_text(absolute_path)
     except Exception as e:
         print(f"Error reading {absolute_path}: {e}")
         return set()
@@ -177,15 +286,68 @@ def get_all_dependencies_recursive(script_path: str, archive_dir_path: Path) ->
     return visited
 
 
-def scan_script_for_func_defs(script_content: str) -> Dict[str, str]:
+def resolve_kos_path(kos_path: str, archive_dir_path: Path) -> Path:
+    """
+    Resolves a kOS archive path (e.g., "0:/src/core/node") to the host path of
+    the corresponding '.ks' file.
+    """
+    if kos_path.startswith("0:/"):
+        # Strip "0:/" and ensure the .ks extension
+        relative_path = Path(kos_path[3:]).with_suffix(".ks")
+    else:
+        # Assume it's already a relative path structure, ensure .ks extension
+        relative_path = Path(kos_path).with_suffix(".ks")
+
+    return Path(archive_dir_path) / relative_path
+
+
+def scan_library_for_func_defs(
+    library_path: str, archive_dir_path: Path
+) -> Dict[str, FunctionDef]:
+    """
+    Reads a library file from the archive and indexes its function definitions.
+    Results are cached per file while an archive_io prefetch is active; callers
+    must not modify the returned dictionary.
+
+    Args:
+        library_path: The kOS-style path to the library (e.g., "0:/src/core/orbit").
+        archive_dir_path: The root Path of the project archive on the host machine.
+
+    Returns:
+        A dictionary of uppercase function names to FunctionDef records, or an
+        empty dictionary (with a printed warning) if the library cannot be read.
+    """
+    absolute_path = resolve_kos_path(library_path, archive_dir_path)
+    cache_key = str(absolute_path)
+    library_index_cache = archive_io.session_cache(LIBRARY_INDEX_CACHE)
+
+    if cache_key in library_index_cache:
+        return library_index_cache[cache_key]
+
+    functions: Dict[str, FunctionDef] = {}
+    if not archive_io.exists(absolute_path):
+        # Print warning if a dependency file is missing
+        print(f"Warning: Library path not found: {absolute_path}")
+    else:
+        try:
+            functions = scan_script_for_func_defs(archive_io.read_text(absolute_path))
+        except Exception as e:
+            # Print warning if a dependency file cannot be read
+            print(f"Error reading or scanning library {absolute_path}: {e}")
+
+    library_index_cache[cache_key] = functions
+    return functions
+
+
+def scan_script_for_func_defs(script_content: str) -> Dict[str, FunctionDef]:
     """
     Scans a kOS script string using a brace-counting parser to reliably extract
     full function definitions. It first strips all kOS comments (single-line //
-    and block /* */) to simplify parsing.
+    and block /* */) and blank lines to simplify parsing.
 
     Returns:
         A dictionary where keys are the uppercase function names and values
-        are their complete function code strings.
+        are FunctionDef records pointing into a single comment-stripped buffer.
     """
 
     # --- 1. Strip ALL comments ---
@@ -201,29 +363,29 @@ def scan_script_for_func_defs(script_content: str) -> Dict[str, str]:
         # If comment found, return content up to comment, stripped of trailing whitespace
         return line[:comment_index].rstrip() if comment_index != -1 else line.rstrip()
 
-    # Apply the stripping function to every line
+    # Apply the stripping function to every line, dropping lines left empty
     cleaned_lines = [strip_sl_comments(line) for line in script_content.splitlines()]
+    lines = [line for line in cleaned_lines if line]
 
-    # Join back the cleaned lines (now without any comments)
-    content_for_parsing = "\n".join(cleaned_lines)
+    # Join back the cleaned lines into the buffer all records point into
+    buffer = "\n".join(lines)
 
     # --- 2. Initialize parser state ---
-    functions: Dict[str, str] = {}
-    lines = content_for_parsing.splitlines()
+    functions: Dict[str, FunctionDef] = {}
 
     is_in_function = False
     brace_count = 0
-    current_function_lines: List[str] = []
+    current_function_start = 0
     current_function_name = ""
 
     # Regex to check for the start of a function and capture the name
     start_pattern = re.compile(r"^\s*function\s+(?P<name>\w+)\s*\{", re.IGNORECASE)
 
     # --- 3. Iterate and parse using the brace counter (simple state machine) ---
+    line_start = 0
     for line in lines:
+        line_end = line_start + len(line)
         line_stripped = line.strip()
-        if not line_stripped:
-            continue
 
         # Check for function start
         if not is_in_function:
@@ -231,57 +393,67 @@ def scan_script_for_func_defs(script_content: str) -> Dict[str, str]:
             if match:
                 is_in_function = True
                 current_function_name = match.group("name")
-                current_function_lines.append(line)
+                # The definition starts at the 'function' keyword (indentation excluded)
+                current_function_start = line_start + (len(line) - len(line.lstrip()))
 
                 # Initialize brace count on the starting line (must be at least 1)
                 brace_count = line_stripped.count("{") - line_stripped.count("}")
+                line_start = line_end + 1
                 continue
 
         # Process lines within a function
         if is_in_function:
-            current_function_lines.append(line)
-
             # Update brace count
             brace_count += line_stripped.count("{")
             brace_count -= line_stripped.count("}")
 
             # Check for function end
             if brace_count == 0:
-                # Store the complete, clean function string
-                full_function_string = "\n".join(current_function_lines).strip()
-                # Store function name in uppercase for case-insensitive lookup later
-                functions[current_function_name.upper()] = full_function_string
+                # Store the function's extent (lines are already right-stripped)
+                # Function names are stored in uppercase for case-insensitive lookup
+                function_def = FunctionDef(
+                    current_function_name, buffer, current_function_start, line_end
+                )
+                functions[function_def.name] = function_def
 
                 # Reset state for the next function
                 is_in_function = False
-                current_function_lines = []
                 current_function_name = ""
 
+        line_start = line_end + 1
+
     return functions
 
 
-def find_potential_calls(content: str) -> Set[str]:
+def find_potential_calls(content: str, start: int = 0, end: Optional[int] = None) -> Set[str]:
     """
     Finds all identifiers immediately followed by an opening parenthesis.
     This captures all potential function calls in the given script content.
 
+    Args:
+        content: The kOS script content (or a buffer containing it).
+        start: Offset at which to start scanning.
+        end: Offset at which to stop scanning (defaults to the end of content).
+
     Returns:
         A set of potential function names, all converted to uppercase.
     """
     # Identifiers (\w+) followed by optional whitespace and an opening parenthesis \(
     call_pattern = re.compile(r"\b(\w+)\s*\(", re.IGNORECASE)
+    if end is None:
+        end = len(content)
     # kOS is case-insensitive, so we return all findings in uppercase for consistent lookup
-    return {call.upper() for call in call_pattern.findall(content)}
+    return {call.upper() for call in call_pattern.findall(content, start, end)}
 
 
 def collect_library_functions(
     script_content: str,
     library_paths: Set[str],
     archive_dir_path: Path,
-) -> Dict[str, str]:
+) -> Dict[str, FunctionDef]:
     """
     Scans the main script's dependencies against functions defined in external
-    library files and returns the code for all used library functions,
+    library files and returns the definitions of all used library functions,
     including deep (transitive) dependencies, using a Breadth-First Search (BFS).
 
     Args:
@@ -291,38 +463,16 @@ def collect_library_functions(
 
     Returns:
         A dictionary where keys are the uppercase names of the used library functions
-        and values are their corresponding function code strings.
+        and values are their FunctionDef records.
     """
 
     # --- 1. Gather all functions from all necessary libraries ---
-    all_library_functions: Dict[str, str] = {}
+    all_library_functions: Dict[str, FunctionDef] = {}
 
     for original_path in library_paths:
-        # Resolve the kOS path (e.g., "0:/src/lib/file") to a host file path
-        if original_path.startswith("0:/"):
-            # Strip "0:/" and ensure the .ks extension
-            relative_path = Path(original_path[3:]).with_suffix(".ks")
-        else:
-            # Assume it's already a relative path structure, ensure .ks extension
-            relative_path = Path(original_path).with_suffix(".ks")
-
-        absolute_path = archive_dir_path / relative_path
-
-        if absolute_path.exists():
-            try:
-                lib_script_content = absolute_path.read_text(encoding="utf-8")
-                # Store function names in uppercase for case-insensitive lookup
-                lib_funcs = {
-                    k.upper(): v
-                    for k, v in scan_script_for_func_defs(lib_script_content).items()
-                }
-                all_library_functions.update(lib_funcs)
-            except Exception as e:
-                # Print warning if a dependency file cannot be read
-                print(f"Error reading or scanning library {absolute_path}: {e}")
-        else:
-            # Print warning if a dependency file is missing
-            print(f"Warning: Library path not found: {absolute_path}")
+        all_library_functions.update(
+            scan_library_for_func_defs(original_path, archive_dir_path)
+        )
 
     all_library_function_names = set(all_library_functions.keys())
 
@@ -348,26 +498,27 @@ def collect_library_functions(
     # --- 4. Iteratively resolve deep (transitive) dependencies (BFS) ---
 
     # Queue for BFS processing (start with direct dependencies)
-    processing_queue: List[str] = list(functions_to_process)
+    # (sorted so the emitted library order is reproducible between builds)
+    processing_queue: List[str] = sorted(functions_to_process)
 
     # Track functions that are finalized to prevent re-processing and infinite loops
     collected_functions: Set[str] = set(functions_to_process)
 
-    # Final output storage: name -> code
-    used_library_functions_code: Dict[str, str] = {}
+    # Final output storage: name -> definition
+    used_library_functions: Dict[str, FunctionDef] = {}
 
     while processing_queue:
         current_func_name = processing_queue.pop(0)
 
-        # 4a. Collect the function's code
+        # 4a. Collect the function's definition
         # This function is guaranteed to exist in the collection
-        func_code = all_library_functions[current_func_name]
-        used_library_functions_code[current_func_name] = func_code
+        func_def = all_library_functions[current_func_name]
+        used_library_functions[current_func_name] = func_def
 
-        # 4b. Scan the function's body for its own dependencies
-        calls_in_func_body = find_potential_calls(func_code)
+        # 4b. Scan the function's body (in place, without slicing) for its own dependencies
+        calls_in_func_body = find_potential_calls(func_def.buffer, func_def.start, func_def.end)
 
-        for sub_call_name in calls_in_func_body:
+        for sub_call_name in sorted(calls_in_func_body):
             # Check if:
             # i) The sub-call is a function provided by one of the libraries, AND
             # ii) We have not already collected or queued it (preventing cycles/duplicates).
@@ -382,7 +533,107 @@ def collect_library_functions(
                 processing_queue.append(sub_call_name)
 
     # Return the dictionary of all deeply required functions
-    return used_library_functions_code
+    return used_library_functions
+
+
+def find_unused_library_imports(script_content: str, archive_dir_path: Path) -> Set[str]:
+    """
+    Cross-references each library imported by a script (RUNONCEPATH calls)
+    against the library functions the script actually reaches.
+
+    A reached function is attributed to the import whose own file defines it.
+    Functions that are only provided by a library's transitive dependencies are
+    attributed to every import that pulls them in.
+
+    Args:
+        script_content: The original (un-refactored) kOS script content.
+        archive_dir_path: The root Path of the project archive on the host machine.
+
+    Returns:
+        The set of imported library paths that contribute no reached function.
+    """
+    # Only imports in code count, not ones that are commented out
+    code = re.sub(r"/\*[\s\S]*?\*/", "", script_content)
+    code = "\n".join(line.split("//", 1)[0] for line in code.splitlines())
+
+    library_paths: Set[str] = set()
+    for match in LIBRARY_IMPORT_PATTERN.finditer(code):
+        original_path = match.group(3).strip()
+        if original_path:
+            library_paths.add(original_path)
+
+    if not library_paths:
+        return set()
+
+    # --- 1. Resolve each import's transitive library closure ---
+    closures: Dict[str, Set[str]] = {
+        path: {path} | get_all_dependencies_recursive(path, archive_dir_path)
+        for path in library_paths
+    }
+    all_paths: Set[str] = set().union(*closures.values())
+    defined_names: Dict[str, Set[str]] = {
+        path: set(scan_library_for_func_defs(path, archive_dir_path).keys())
+        for path in all_paths
+    }
+
+    # --- 2. Find every library function the script reaches ---
+    reached = set(collect_library_functions(script_content, all_paths, archive_dir_path))
+
+    # --- 3. Attribute reached functions to imports ---
+    used_paths: Set[str] = {
+        path for path in library_paths if defined_names[path] & reached
+    }
+    # Functions not defined directly by any import come from transitive dependencies
+    indirect = reached - set().union(*(defined_names[path] for path in library_paths))
+    for path in library_paths - used_paths:
+        if any(defined_names[dep] & indirect for dep in closures[path]):
+            used_paths.add(path)
+
+    return library_paths - used_paths
+
+
+def remove_library_imports(script_content: str, library_paths: Set[str]) -> str:
+    """
+    Removes the RUNONCEPATH statements that import any of the given library paths.
+    Statements that are the only code on their line are removed together with
+    that line; other statements are cut out of their line, which is kept.
+    Imports after a // comment marker are left untouched.
+
+    Args:
+        script_content: The original (un-refactored) kOS script content.
+        library_paths: The library paths whose imports should be removed.
+
+    Returns:
+        The script content without those import statements.
+    """
+    if not library_paths:
+        return script_content
+
+    def import_remover(match: re.Match) -> str:
+        if match.group(2).strip() in library_paths:
+            return ""
+        return match.group(0)
+
+    output_lines: List[str] = []
+    for line in script_content.splitlines(keepends=True):
+        body = line.rstrip("\r\n")
+        newline = line[len(body):]
+
+        # Only rewrite the code before any // comment
+        comment_index = body.find("//")
+        code = body if comment_index == -1 else body[:comment_index]
+        comment = "" if comment_index == -1 else body[comment_index:]
+
+        new_code = LIBRARY_IMPORT_STATEMENT_PATTERN.sub(import_remover, code)
+        if new_code == code:
+            output_lines.append(line)
+        elif not new_code.strip():
+            # The import was the only code on the line: drop the whole line
+            continue
+        else:
+            output_lines.append(new_code.rstrip() + (" " + comment if comment else "") + newline)
+
+    return "".join(output_lines)
 
 
 def extract_kos_global_parameters(script_content: str) -> List[str]:
@@ -472,8 +723,9 @@ if __name__ == "__main__":
     )
     print(library_functions.keys())
 
-    library_content = f"//{lib_name}\n@lazyGlobal off.\n\n"
-    for full_function_string in reversed(library_functions.values()):
-        library_content += full_function_string + "\n\n"
     print(f'Wrote library to: "{(Path(archive_dir_path) / lib_dst[3:])}"')
-    (Path(archive_dir_path) / lib_dst[3:]).write_text(library_content)
+    with open(Path(archive_dir_path) / lib_dst[3:], "w", encoding="utf-8") as lib_file:
+        lib_file.write(f"//{lib_name}\n@lazyGlobal off.\n\n")
+        for function_def in reversed(library_functions.values()):
+            lib_file.write(function_def.text)
+            lib_file.write("\n\n")
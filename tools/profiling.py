@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Profile Build Instrumentation for kOS Packages
+
+This module rewrites package output for "profile builds": instrumented copies
+of a package that record real in-flight timings. Samples are buffered in
+memory and flushed as lines of a log file with kOS's LOG command:
+
+    H <ipu> <time:seconds> <build id>   header, written each time the library loads
+    E<id> <time:seconds> <opcodesleft>  entry of a function / loop iteration
+    X<id> <time:seconds> <opcodesleft>  exit of a function / loop iteration
+    F <time:seconds> <opcodesleft before> <opcodesleft after>
+                                        cost of a flush, excluded from the
+                                        functions and loops it interrupted
+
+Each flush goes to the archive while connected and to the vessel's own volume
+otherwise; when the vessel's volume runs low, sampling stops instead of
+failing the flight script. Id 0 is a calibration function (an empty profiled
+call) sampled when the library loads, so the analyzer can subtract the
+profiler's own per-call overhead.
+
+Ids are assigned at build time and written to a 'profile_map.json' next to the
+package, which 'analyze_profile.py' uses to turn the log into a report. Ids are
+reassigned by every build while the log keeps growing, so the map carries a
+build id (a digest of its entries) that the header repeats; the analyzer only
+attributes runs whose header matches the current map.
+
+Instrumentation points:
+1. Extracted library functions are renamed to '<name>_unprofiled' and wrapped by
+   a function with the original name and parameters that samples on entry and
+   exit. Wrapping (rather than patching each RETURN) keeps early returns exact.
+2. Main loops ('until' loops that are not nested in a function or another
+   'until' loop) in offline scripts sample at the start and end of each
+   iteration, and flush the buffer once the loop finishes (as does the end of
+   the script). Iterations left through BREAK have no exit sample and are
+   discarded by the analyzer.
+"""
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Suffix appended to a package name for its instrumented copy
+PROFILE_SUFFIX = "_profile"
+# Suffix appended to the name of a wrapped (original) library function
+UNPROFILED_SUFFIX = "_unprofiled"
+# File written next to a profile package, mapping sample ids to names
+PROFILE_MAP_NAME = "profile_map.json"
+# Fallback log on the vessel's own volume when the archive is unreachable
+LOCAL_PROFILE_LOG = "1:/profile.log"
+# Samples buffered in memory before they are flushed to the log
+FLUSH_SAMPLES = 100
+# Bytes always left free on the vessel's volume (e.g. for state.json)
+LOCAL_RESERVE_BYTES = 2000
+# Sample id of the calibration function measuring the profiler's overhead
+CALIBRATION_ID = 0
+# Number of calibration calls made when the library loads
+CALIBRATION_CALLS = 5
+
+FUNCTION_START_PATTERN = re.compile(r"^(\s*function\s+)(\w+)(\s*\{)", re.IGNORECASE)
+PARAMETER_PATTERN = re.compile(
+    r"^\s*(?:declare\s+parameter|parameter)\s+(?P<params>.*?)\.?\s*$", re.IGNORECASE
+)
+UNTIL_LOOP_PATTERN = re.compile(r"^\s*until\b[^{]*\{$", re.IGNORECASE)
+
+
+class ProfileMap:
+    """
+    Assigns sample ids to instrumented functions and loops.
+
+    Id 0 is reserved for the calibration function (see profiler_runtime).
+    """
+
+    def __init__(self, package: str, log_path: str):
+        self.package = package
+        self.log_path = log_path
+        self.entries: Dict[int, Dict[str, str]] = {}
+
+    def add(self, name: str, kind: str) -> int:
+        """Registers a function or loop and returns its sample id."""
+        sample_id = len(self.entries) + 1
+        self.entries[sample_id] = {"name": name, "kind": kind}
+        return sample_id
+
+    def build_id(self) -> str:
+        """
+        Returns a short digest of the registered ids, which changes whenever a
+        build assigns ids differently.
+        """
+        content = json.dumps([self.package, self.entries], sort_keys=True)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+
+    def write(self, path: Path) -> None:
+        """Writes the map as JSON for the analyzer."""
+        content = {
+            "package": self.package,
+            "log": self.log_path,
+            "build_id": self.build_id(),
+            "ids": {str(k): v for k, v in self.entries.items()},
+        }
+        path.write_text(json.dumps(content, indent=2) + "\n", encoding="utf-8")
+
+
+def profiler_runtime(log_path: str, build_id: str) -> str:
+    """
+    Returns the kOS profiler runtime emitted at the top of a profile library.
+
+    Samples are appended to an in-memory list and flushed every FLUSH_SAMPLES
+    samples (and by profileFlush()). The target is chosen on every flush: the
+    archive while connected, the vessel otherwise, as long as the vessel keeps
+    LOCAL_RESERVE_BYTES free; past that, sampling stops. The header line
+    records the CPU's IPU so the analyzer can count instructions across ticks,
+    and the build id so it can skip runs of other builds.
+
+    Args:
+        log_path: The archive log path (e.g., "0:/profile/standard_launch.log").
+        build_id: The build id of the complete profile map.
+    """
+    calibration = instrument_library_function(
+        "function profileCalibrate {\n}", None, sample_id=CALIBRATION_ID
+    )
+    return (
+        "// Profiler runtime (profile build)\n"
+        "global profileEnabled is true.\n"
+        "global profileSamples is list().\n"
+        "\n"
+        "function profileFlush {\n"
+        "    if profileSamples:length = 0 {\n"
+        "        return.\n"
+        "    }\n"
+        "    local opcodesBefore is opcodesleft.\n"
+        "    local chunk is profileSamples:join(char(10)).\n"
+        "    profileSamples:clear().\n"
+        "    if homeConnection:isconnected() {\n"
+        f'        log chunk to "{log_path}".\n'
+        f"    }} else if volume(1):freespace > chunk:length + {LOCAL_RESERVE_BYTES} {{\n"
+        f'        log chunk to "{LOCAL_PROFILE_LOG}".\n'
+        "    } else if profileEnabled {\n"
+        "        set profileEnabled to false.\n"
+        '        print "Profiler stopped: no connection and local volume full.".\n'
+        "    }\n"
+        "    if profileEnabled {\n"
+        '        profileSamples:add("F " + time:seconds + " " + opcodesBefore + " " + opcodesleft).\n'
+        "    }\n"
+        "}\n"
+        "\n"
+        "function profileEnter {\n"
+        "    parameter id.\n"
+        "    if profileEnabled {\n"
+        '        profileSamples:add("E" + id + " " + time:seconds + " " + opcodesleft).\n'
+        f"        if profileSamples:length >= {FLUSH_SAMPLES} {{\n"
+        "            profileFlush().\n"
+        "        }\n"
+        "    }\n"
+        "}\n"
+        "\n"
+        "function profileExit {\n"
+        "    parameter id.\n"
+        "    if profileEnabled {\n"
+        '        profileSamples:add("X" + id + " " + time:seconds + " " + opcodesleft).\n'
+        f"        if profileSamples:length >= {FLUSH_SAMPLES} {{\n"
+        "            profileFlush().\n"
+        "        }\n"
+        "    }\n"
+        "}\n"
+        "\n"
+        f"{calibration}\n"
+        "\n"
+        f'profileSamples:add("H " + config:ipu + " " + time:seconds + " {build_id}").\n'
+        f"from {{local i is 0.}} until i = {CALIBRATION_CALLS} step {{set i to i + 1.}} do {{\n"
+        "    profileCalibrate().\n"
+        "}\n"
+        "profileFlush().\n"
+        "\n"
+    )
+
+
+def split_parameter_names(params: str) -> List[str]:
+    """
+    Splits the body of a PARAMETER statement (e.g., "a, b is list(1, 2)") into
+    parameter names, ignoring commas nested inside default values.
+    """
+    names: List[str] = []
+    depth = 0
+    item = ""
+    for ch in params + ",":
+        if ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        if ch == "," and depth == 0:
+            match = re.match(r"\s*(\w+)", item)
+            if match:
+                names.append(match.group(1))
+            item = ""
+        else:
+            item += ch
+    return names
+
+
+def instrument_library_function(
+    function_text: str, profile_map: Optional[ProfileMap], sample_id: Optional[int] = None
+) -> str:
+    """
+    Renames a library function and wraps it in a profiled function with the
+    original name and parameters.
+
+    Args:
+        function_text: The complete (comment-stripped) kOS function definition.
+        profile_map: The map the function's sample id is registered in.
+        sample_id: A fixed sample id to use instead of registering one.
+
+    Returns:
+        The original function (renamed) followed by its profiled wrapper.
+    """
+    match = FUNCTION_START_PATTERN.match(function_text)
+    if not match:
+        return function_text
+    name = match.group(2)
+    unprofiled_name = name + UNPROFILED_SUFFIX
+    if sample_id is None:
+        sample_id = profile_map.add(name, "function")
+
+    renamed = FUNCTION_START_PATTERN.sub(
+        lambda m: m.group(1) + unprofiled_name + m.group(3), function_text, count=1
+    )
+
+    # Collect the parameter statements at the function's own scope (depth 1)
+    parameter_lines: List[str] = []
+    parameter_names: List[str] = []
+    depth = 0
+    for line in function_text.splitlines():
+        stripped = line.strip()
+        param_match = PARAMETER_PATTERN.match(stripped) if depth == 1 else None
+        if param_match:
+            parameter_lines.append(stripped)
+            parameter_names.extend(split_parameter_names(param_match.group("params")))
+        depth += stripped.count("{") - stripped.count("}")
+
+    wrapper_lines = [f"function {name} {{"]
+    wrapper_lines += [f"    {line}" for line in parameter_lines]
+    wrapper_lines += [
+        f"    profileEnter({sample_id}).",
+        f"    local profileResult is {unprofiled_name}({', '.join(parameter_names)}).",
+        f"    profileExit({sample_id}).",
+        "    return profileResult.",
+        "}",
+    ]
+    return renamed + "\n\n" + "\n".join(wrapper_lines)
+
+
+def strip_line_comment(line: str) -> str:
+    """Returns a line without its // comment, right-stripped."""
+    comment_index = line.find("//")
+    return line[:comment_index].rstrip() if comment_index != -1 else line.rstrip()
+
+
+def find_main_loops(lines: List[str]) -> List[Tuple[int, int]]:
+    """
+    Finds main loops: 'until' loops whose header ends in '{' and that are not
+    nested inside a function or another 'until' loop.
+
+    Returns:
+        A list of (header_line_index, closing_line_index) pairs, where the
+        closing line consists of the loop's '}' only.
+    """
+    loops: List[Tuple[int, int]] = []
+    # Stack of (block kind, opening line index)
+    stack: List[Tuple[str, int]] = []
+    for index, line in enumerate(lines):
+        stripped = strip_line_comment(line).strip()
+        if FUNCTION_START_PATTERN.match(stripped):
+            kind = "function"
+        elif UNTIL_LOOP_PATTERN.match(stripped) and stripped.count("{") == 1:
+            kind = "until"
+            if any(k in ("function", "until") for k, _ in stack):
+                kind = "nested"
+        else:
+            kind = "block"
+
+        opened = False
+        for ch in stripped:
+            if ch == "{":
+                stack.append((kind if not opened else "block", index))
+                opened = True
+            elif ch == "}" and stack:
+                closed_kind, header_index = stack.pop()
+                if closed_kind == "until" and stripped == "}":
+                    loops.append((header_index, index))
+    return loops
+
+
+def instrument_script_loops(
+    script_content: str,
+    script_name: str,
+    lib_name: str,
+    profile_map: ProfileMap,
+    source_content: Optional[str] = None,
+) -> str:
+    """
+    Adds entry and exit samples to every main-loop iteration of a script, and
+    makes sure a script with main loops loads the library (and its profiler).
+
+    Args:
+        script_content: The (refactored) kOS script content.
+        script_name: The script's file name, used to name loops ("launch.ks:L70").
+        lib_name: The name of the package library file.
+        profile_map: The map loop sample ids are registered in.
+        source_content: The original script source. Refactoring removes import
+            lines, so loops are named after their line in the source instead.
+
+    Returns:
+        The instrumented script content (unchanged if it has no main loops).
+    """
+    lines = script_content.splitlines()
+    loops = find_main_loops(lines)
+    if not loops:
+        return script_content
+
+    # Refactoring only rewrites or removes RUNPATH / RUNONCEPATH lines, so the
+    # n-th main loop of the script is the n-th main loop of the source.
+    line_numbers = [header_index + 1 for header_index, _ in loops]
+    if source_content is not None:
+        source_loops = find_main_loops(source_content.splitlines())
+        if len(source_loops) == len(loops):
+            line_numbers = [header_index + 1 for header_index, _ in source_loops]
+
+    inserts: Dict[int, str] = {}
+    appends: Dict[int, str] = {}
+    for (header_index, closing_index), line_number in zip(loops, line_numbers):
+        sample_id = profile_map.add(f"{script_name}:L{line_number}", "loop")
+        header = lines[header_index]
+        indent = header[: len(header) - len(header.lstrip())] + "    "
+        # Entry goes after the header line, exit before the closing line, and
+        # buffered samples are flushed once the loop has finished
+        inserts[header_index + 1] = inserts.get(header_index + 1, "") + f"{indent}profileEnter({sample_id}).\n"
+        inserts[closing_index] = inserts.get(closing_index, "") + f"{indent}profileExit({sample_id}).\n"
+        appends[closing_index] = appends.get(closing_index, "") + f"{indent[4:]}profileFlush().\n"
+
+    output = ""
+    for index, line in enumerate(lines):
+        output += inserts.get(index, "") + line + "\n" + appends.get(index, "")
+    return add_library_load(output, lib_name) + "profileFlush().\n"
+
+
+def add_library_load(script_content: str, lib_name: str) -> str:
+    """
+    Makes sure a profiled script loads the package library (which holds the
+    profiler runtime) at its top level, inserting the load after the script's
+    global PARAMETER statements and '@lazyGlobal' directive if needed.
+    """
+    lines = script_content.splitlines()
+    insert_index = 0
+    depth = 0
+    for index, line in enumerate(lines):
+        stripped = strip_line_comment(line).strip()
+        if depth == 0 and f"1:/lib/{lib_name}".lower() in stripped.lower():
+            return script_content
+        if depth == 0 and (
+            PARAMETER_PATTERN.match(stripped) or stripped.lower().startswith("@lazyglobal")
+        ):
+            insert_index = index + 1
+        depth = max(0, depth + stripped.count("{") - stripped.count("}"))
+
+    lines.insert(insert_index, f'runoncepath("1:/lib/{lib_name}").')
+    return "\n".join(lines) + "\n"